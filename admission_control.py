@@ -0,0 +1,189 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# --- Optional: file locking (POSIX only) ---
+try:
+    import fcntl
+except ImportError:
+    print("WARNING: fcntl not found. The upload budget is only shared within one process.")
+    fcntl = None
+
+# Memory (in MB) that concurrent uploads may use on this machine, shared by all
+# gunicorn workers. Dash serializes each response after its reservation is released,
+# so keep some headroom below the container's memory limit.
+UPLOAD_MEMORY_BUDGET_MB = int(os.environ.get('UPLOAD_MEMORY_BUDGET_MB', '1024'))
+# Where the shared budget state and queued uploads are kept (must be shared by all workers)
+UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'analysis-app-uploads'))
+# A queued upload that hasn't retried within this many seconds gives up its place.
+QUEUE_TICKET_TIMEOUT_SECONDS = 30
+
+
+class UploadRejected(Exception):
+    """Raised when an upload can't be admitted (too large, or its queue place expired)."""
+
+
+def _pid_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MemoryBudget:
+    """
+    First-come, first-served admission control for memory-heavy uploads,
+    shared by every worker process through a lock-protected state file.
+
+    A new upload is admitted with its estimated number of bytes if the budget
+    has room and nobody is queued ahead of it; the caller must release() it
+    when done. Otherwise the decoded file is spooled to disk under a ticket,
+    and later attempts only need that ticket.
+    """
+
+    def __init__(self, budget_bytes, state_dir):
+        self.budget_bytes = budget_bytes
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, 'budget.json')
+        # Separate from the state file, which is replaced (not rewritten) on every update
+        self.lock_path = os.path.join(state_dir, 'budget.lock')
+        self.thread_lock = threading.Lock()  # flock doesn't exclude threads of one process
+
+    @contextmanager
+    def _locked_state(self):
+        """Yields the shared state dict and writes it back, holding the lock throughout."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        with self.thread_lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self._read_state()
+                self._expire_stale_entries(state)
+                yield state
+                # Write a new file and swap it in, so a worker killed mid-write
+                # can't leave half-written JSON behind
+                temp_path = f'{self.state_path}.{os.getpid()}.tmp'
+                with open(temp_path, 'w') as state_file:
+                    json.dump(state, state_file)
+                os.replace(temp_path, self.state_path)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            print(f"Upload budget state was unreadable, starting empty: {e}")
+        return {'admitted': {}, 'queue': {}}
+
+    def _spool_path(self, ticket):
+        return os.path.join(self.state_dir, f'{ticket}.upload')
+
+    def _expire_stale_entries(self, state):
+        # Reservations held by a worker that died (e.g. OOM-killed) are returned
+        for ticket, entry in list(state['admitted'].items()):
+            if not _pid_is_alive(entry['pid']):
+                del state['admitted'][ticket]
+        # Queued uploads whose browser stopped retrying lose their place
+        cutoff = time.time() - QUEUE_TICKET_TIMEOUT_SECONDS
+        for ticket, entry in list(state['queue'].items()):
+            if entry['last_seen'] < cutoff:
+                del state['queue'][ticket]
+                self._remove_spooled(ticket)
+
+    def _remove_spooled(self, ticket):
+        try:
+            os.remove(self._spool_path(ticket))
+        except FileNotFoundError:
+            pass
+
+    def _admit_or_queue(self, state, ticket, estimated_bytes):
+        in_use = sum(entry['bytes'] for entry in state['admitted'].values())
+        is_next = not state['queue'] or next(iter(state['queue'])) == ticket
+        if is_next and in_use + estimated_bytes <= self.budget_bytes:
+            state['queue'].pop(ticket, None)
+            state['admitted'][ticket] = {'bytes': estimated_bytes, 'pid': os.getpid()}
+            return True, None
+
+        # Updating an existing entry keeps its place (dicts keep insertion order)
+        state['queue'][ticket] = {'bytes': estimated_bytes, 'last_seen': time.time()}
+        return False, list(state['queue']).index(ticket) + 1
+
+    def submit(self, file_buffer, estimated_bytes):
+        """
+        Asks to admit a new upload. Returns (ticket, queue_position);
+        queue_position is None when admitted, otherwise the upload has been
+        spooled to disk. Raises UploadRejected if it is larger than the whole budget.
+        """
+        if estimated_bytes > self.budget_bytes:
+            raise UploadRejected(
+                f"This file needs about {estimated_bytes / 2**20:,.0f} MB to analyze, "
+                f"more than the server's limit of {self.budget_bytes / 2**20:,.0f} MB."
+            )
+        ticket = uuid.uuid4().hex
+        # Spool before taking the lock, so a large write doesn't stall every other worker
+        part_path = f'{self._spool_path(ticket)}.part'
+        os.makedirs(self.state_dir, exist_ok=True)
+        try:
+            with open(part_path, 'wb') as spool_file:
+                spool_file.write(file_buffer.getbuffer())
+            with self._locked_state() as state:
+                admitted, queue_position = self._admit_or_queue(state, ticket, estimated_bytes)
+                if not admitted:
+                    # Renamed under the lock so the queue entry never exists without its file
+                    os.replace(part_path, self._spool_path(ticket))
+        finally:
+            try:
+                os.remove(part_path)  # Still there only if admitted straight away (or on error)
+            except FileNotFoundError:
+                pass
+        return ticket, queue_position
+
+    def retry(self, ticket):
+        """
+        Retries a queued upload. Returns (file_buffer, queue_position); the
+        buffer holds the spooled file once admitted, otherwise it is None.
+        """
+        with self._locked_state() as state:
+            entry = state['queue'].get(ticket)
+            if entry is None:
+                raise UploadRejected("Your place in the upload queue expired. Please upload the file again.")
+            admitted, queue_position = self._admit_or_queue(state, ticket, entry['bytes'])
+            if not admitted:
+                return None, queue_position
+
+        # Admitted, so the spooled file is ours and can be read outside the lock
+        try:
+            with open(self._spool_path(ticket), 'rb') as spool_file:
+                file_buffer = io.BytesIO(spool_file.read())
+        except OSError as e:
+            # e.g. removed by a temp cleaner: give the reservation back
+            self.release(ticket)
+            raise UploadRejected("Your queued file could not be read back. Please upload it again.") from e
+        self._remove_spooled(ticket)
+        return file_buffer, None
+
+    def cancel(self, ticket):
+        """Drops a queued upload, e.g. when the user uploads another file instead."""
+        with self._locked_state() as state:
+            if state['queue'].pop(ticket, None) is not None:
+                self._remove_spooled(ticket)
+
+    def release(self, ticket):
+        with self._locked_state() as state:
+            state['admitted'].pop(ticket, None)
+
+
+upload_budget = MemoryBudget(UPLOAD_MEMORY_BUDGET_MB * 2**20, UPLOAD_SPOOL_DIR)
@@ -1,5 +1,32 @@
 import pandas as pd
+import numpy as np
 import io
+import os
+import re
+import hashlib
+import zipfile
+import threading
+from collections import OrderedDict
+
+# --- Optional: Parquet support ---
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    print("WARNING: pyarrow not found. Parquet uploads will not work.")
+    pq = None
+
+# Rows read per chunk / record batch when streaming large CSV and Parquet files.
+STREAM_CHUNK_ROWS = 100_000
+# Rows kept (uniformly at random) for charts, previews and cleaning.
+STREAM_SAMPLE_ROWS = 5_000
+# Relative variance below which a streamed column counts as constant
+CONSTANT_VARIANCE_TOLERANCE = 1e-10
+
+# --- Memory estimation (used for upload admission control) ---
+# Rough cost of one cell while it is parsed into pandas and serialized to JSON.
+BYTES_PER_CELL = 250
+# Fallback when a file's dimensions can't be read cheaply (e.g. legacy .xls)
+FILE_SIZE_MULTIPLIER = 20
 
 # Function to read and analyze Excel file
 def analyze_excel(file_path_or_buffer):
@@ -34,8 +61,371 @@ def analyze_excel(file_path_or_buffer):
         print(f"Error loading the Excel file: {e}")
         # Return the error message
         return None, None, str(e)
+
+
+# --- NEW: Streaming analysis for large CSV / Parquet files ---
+class _StreamingProfile:
+    """
+    Builds the same summary as analyze_excel for one table, one chunk at a time.
+    Only the running totals and a bounded random sample are kept in memory.
+    """
+
+    def __init__(self, sample_rows=STREAM_SAMPLE_ROWS, seed=0):
+        self.sample_rows = sample_rows
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.columns = None
+        self.numeric_columns = None
+        self.null_counts = None
+        self.head = None
+        self.sample = None
+        self.sample_keys = None
+        # Pairwise running moments (rows where both columns are present),
+        # accumulated around a per-column shift for numerical stability.
+        self.shift = None
+        self.n = self.sx = self.sxx = self.sxy = None
+
+    def update(self, chunk):
+        if self.columns is None:
+            self.columns = chunk.columns.tolist()
+            self.numeric_columns = chunk.select_dtypes(include='number').columns.tolist()
+            self.null_counts = pd.Series(0, index=chunk.columns, dtype='int64')
+            self.head = chunk.head()
+            k = len(self.numeric_columns)
+            self.n, self.sx, self.sxx, self.sxy = (np.zeros((k, k)) for _ in range(4))
+
+        # A later chunk may hold stray text in a numeric column; treat it as missing
+        # everywhere, so null counts, moments and the sample all agree.
+        drifted = [c for c in self.numeric_columns if not pd.api.types.is_numeric_dtype(chunk[c])]
+        if drifted:
+            chunk = chunk.copy()
+            chunk[drifted] = chunk[drifted].apply(pd.to_numeric, errors='coerce')
+
+        self.rows += len(chunk)
+        self.null_counts += chunk.isnull().sum()
+        self._update_moments(chunk)
+        self._update_sample(chunk)
+
+    def _update_moments(self, chunk):
+        if not self.numeric_columns:
+            return
+        values = chunk[self.numeric_columns].to_numpy(dtype=float, na_value=np.nan)
+        if self.shift is None:
+            # Mean of the first chunk; columns that are all missing there get 0
+            counts = (~np.isnan(values)).sum(axis=0)
+            self.shift = np.nansum(values, axis=0) / np.maximum(counts, 1)
+        present = (~np.isnan(values)).astype(float)
+        x = np.nan_to_num(values - self.shift)
+        self.n += present.T @ present
+        self.sx += x.T @ present
+        self.sxx += (x * x).T @ present
+        self.sxy += x.T @ x
+
+    def _update_sample(self, chunk):
+        # Bottom-k of random keys over all rows seen so far is a uniform sample.
+        keys = self.rng.random(len(chunk))
+        if self.sample is not None:
+            chunk = pd.concat([self.sample, chunk], ignore_index=True)
+            keys = np.concatenate([self.sample_keys, keys])
+        if len(keys) > self.sample_rows:
+            keep = np.sort(np.argpartition(keys, self.sample_rows)[:self.sample_rows])
+            chunk = chunk.iloc[keep].reset_index(drop=True)
+            keys = keys[keep]
+        self.sample, self.sample_keys = chunk, keys
+
+    def correlation(self):
+        """Pairwise-complete Pearson correlation, like DataFrame.corr()."""
+        cols = self.numeric_columns
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = self.n * self.sxy - self.sx * self.sx.T
+            var_x = self.n * self.sxx - self.sx ** 2
+            corr = cov / np.sqrt(var_x * var_x.T)
+        corr = np.clip(corr, -1.0, 1.0)
+        # A constant column leaves rounding noise instead of exactly 0 variance, so
+        # compare against the size of the terms that cancelled.
+        no_variance = var_x <= CONSTANT_VARIANCE_TOLERANCE * self.n * self.sxx
+        # Exact 1.0, so the report can drop self-pairs
+        np.fill_diagonal(corr, 1.0)
+        # Like DataFrame.corr(): NaN wherever either column is constant over the shared rows
+        corr[no_variance | no_variance.T] = np.nan
+        corr[self.n < 2] = np.nan
+        return pd.DataFrame(corr, index=cols, columns=cols)
+
+    def summary(self):
+        return {
+            'Shape': (self.rows, len(self.columns)),
+            'Columns': self.columns,
+            'Numeric_Columns': self.numeric_columns,
+            'Categorical_Columns': [c for c in self.columns if c not in self.numeric_columns],
+            'Head': self.head.to_dict(orient='records'),
+            # Extra fields only present for streamed files
+            'Null_Counts': {c: int(v) for c, v in self.null_counts.items()},
+            'Correlation': self.correlation().to_dict(),
+            'Sample_Rows': len(self.sample),
+        }
+
+
+def _analyze_chunks(chunks, table_name, sample_rows):
+    """Runs a chunk iterator through a _StreamingProfile and packages the result."""
+    profile = _StreamingProfile(sample_rows=sample_rows)
+    for chunk in chunks:
+        profile.update(chunk)
+
+    if profile.columns is None:
+        return None, None, "The uploaded file contains no columns or is empty."
+
+    return {table_name: profile.summary()}, {table_name: profile.sample}, None
+
+
+def _table_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0] if filename else 'Data'
+
+
+def analyze_csv(file_path_or_buffer, filename=None, chunksize=STREAM_CHUNK_ROWS, sample_rows=STREAM_SAMPLE_ROWS):
+    """
+    Streams a CSV file in chunks and returns a summary, a dictionary holding a
+    random sample of the rows, and an error message (if any).
+    """
+    try:
+        chunks = pd.read_csv(file_path_or_buffer, chunksize=chunksize)
+        return _analyze_chunks(chunks, _table_name(filename), sample_rows)
+    except pd.errors.EmptyDataError:
+        return None, None, "The uploaded file contains no columns or is empty."
+    except Exception as e:
+        print(f"Error loading the CSV file: {e}")
+        return None, None, str(e)
+
+
+def analyze_parquet(file_path_or_buffer, filename=None, batch_size=STREAM_CHUNK_ROWS, sample_rows=STREAM_SAMPLE_ROWS):
+    """
+    Streams a Parquet file record batch by record batch (never more than one
+    row group at a time) and returns the same triple as analyze_csv.
+    """
+    if pq is None:
+        return None, None, "Parquet support requires the 'pyarrow' library, which is not installed."
+    try:
+        parquet_file = pq.ParquetFile(file_path_or_buffer)
+        chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=batch_size))
+        return _analyze_chunks(chunks, _table_name(filename), sample_rows)
+    except Exception as e:
+        print(f"Error loading the Parquet file: {e}")
+        return None, None, str(e)
+
+
+def analyze_file(file_path_or_buffer, filename=None):
+    """
+    Picks the right analyzer from the file extension.
+    Excel is loaded whole; CSV and Parquet are streamed.
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        return analyze_csv(file_path_or_buffer, filename)
+    if extension == '.parquet':
+        return analyze_parquet(file_path_or_buffer, filename)
+    return analyze_excel(file_path_or_buffer)
+
+
+_WORKSHEET_PART = re.compile(r'xl/worksheets/sheet\d+\.xml')
+_DIMENSION_TAG = re.compile(rb'<(?:\w+:)?dimension\s+ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+def _excel_cell_count(file_buffer):
+    """
+    Reads the sheet dimensions of an .xlsx file from the <dimension> tag at the
+    top of each worksheet, without parsing shared strings, styles or cells.
+    """
+    cells = 0
+    with zipfile.ZipFile(file_buffer) as workbook:
+        worksheets = [name for name in workbook.namelist() if _WORKSHEET_PART.fullmatch(name)]
+        if not worksheets:
+            return None
+        for name in worksheets:
+            with workbook.open(name) as worksheet:
+                match = _DIMENSION_TAG.search(worksheet.read(4096))
+            if match is None:
+                return None  # Sheet has no stored dimension
+            first_col, first_row, last_col, last_row = match.groups()
+            last_col, last_row = last_col or first_col, last_row or first_row
+            rows = int(last_row) - int(first_row) + 1
+            cols = _column_number(last_col.decode()) - _column_number(first_col.decode()) + 1
+            cells += rows * cols
+    return cells
+
+
+def _stream_cell_count(file_buffer, extension):
+    """Cells held at once while streaming: one chunk plus the kept sample."""
+    rows_in_memory = STREAM_CHUNK_ROWS + STREAM_SAMPLE_ROWS
+    if extension == '.parquet':
+        if pq is None:
+            return None
+        metadata = pq.ParquetFile(file_buffer).metadata
+        return min(metadata.num_rows, rows_in_memory) * metadata.num_columns
+    columns = len(pd.read_csv(file_buffer, nrows=0).columns)
+    # A CSV can't parse to more cells than it has bytes
+    return min(rows_in_memory * columns, len(file_buffer.getbuffer()))
+
+
+def estimate_peak_memory(file_buffer, filename=None):
+    """
+    Estimates the peak memory (in bytes) needed to analyze and store an
+    uploaded file, using only its size and metadata. The buffer is rewound.
+    """
+    file_size = len(file_buffer.getbuffer())
+    extension = os.path.splitext(filename or '')[1].lower()
+    try:
+        if extension in ('.csv', '.parquet'):
+            cells = _stream_cell_count(file_buffer, extension)
+        elif extension == '.xls':
+            cells = None
+        else:
+            cells = _excel_cell_count(file_buffer)
+    except Exception as e:
+        print(f"Could not read file dimensions, estimating from size: {e}")
+        cells = None
+    finally:
+        file_buffer.seek(0)
+
+    if cells is None:
+        return file_size * FILE_SIZE_MULTIPLIER
+    return file_size + cells * BYTES_PER_CELL
+
+
+# --- NEW: Semantic column typing (names + sampled values, cached per schema) ---
+_TIME_NAMES = re.compile(r'date|day|month|year|timestamp|time')
+_CATEGORY_NAMES = re.compile(r'region|country|city|state|department|category|gender|status|type|group')
+_MEASURE_NAMES = re.compile(r'sales|amount|revenue|count|cases|salary|price|quantity|value|score|rate|cost|profit')
+_ID_NAMES = re.compile(r'(?:^|[\s_.-])id(?:$|[\s_.-])|uuid|key|code|number')  # 'id' as a word, not 'paid'
+
+_DATE_VALUES = re.compile(
+    r'\d{4}[-/.]\d{1,2}[-/.]\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?'  # 2024-01-31, 2024-01-31 12:00:00
+    r'|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}'                                    # 31/01/2024, 1.31.24
+    r'|\d{1,2}[ -][A-Za-z]{3,9}\.?[ -]\d{2,4}'                              # 31 Jan 2024, 31-Jan-24
+    r'|[A-Za-z]{3,9}\.? \d{1,2},? \d{4}'                                    # Jan 31, 2024
+)
+_CURRENCY_VALUES = re.compile(r'\(?-?\s*[$€£¥₹]\s*-?[\d,]*\.?\d+\)?|-?[\d,]*\.?\d+\s*[$€£¥₹]')
+_ID_VALUES = re.compile(r'[A-Za-z]{0,6}[-_]?\d{3,}|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+# Rows sampled per sheet to judge values, and the share that must match a pattern
+TYPE_SAMPLE_ROWS = 1_000
+VALUE_MATCH_SHARE = 0.9
+# Text columns with at most this many distinct values (or half the rows) are categories
+CATEGORY_MAX_UNIQUE = 50
+
+_column_type_cache = OrderedDict()  # schema + fingerprint hash -> column types
+_column_type_cache_lock = threading.Lock()
+_COLUMN_TYPE_CACHE_SIZE = 256
+
+
+def _schema_hash(df, fingerprint=None):
+    if fingerprint is None:
+        schema = repr([(str(c), str(t)) for c, t in df.dtypes.items()])
+        fingerprint = df.head().to_dict(orient='records')
+    else:
+        # Cleaning can change dtypes (e.g. float -> int once NaNs are dropped), so a
+        # caller-supplied fingerprint is keyed with the column names only
+        schema = repr([str(c) for c in df.columns])
+    return hashlib.sha1((schema + repr(fingerprint)).encode()).hexdigest()
+
+
+def _name_first(cols, name_matches):
+    """Orders columns whose name matches a keyword ahead of the rest (report examples use the first)."""
+    return [c for c in cols if name_matches[c]] + [c for c in cols if not name_matches[c]]
+
+
+def infer_column_types(df, fingerprint=None):
+    """
+    Classifies every column of a DataFrame as 'time', 'measure', 'currency'
+    (amounts stored as text), 'category', 'id' or 'text', using its name and a
+    sample of its values. Returns a dict of role -> list of columns.
+
+    Results are cached by the sheet's column names plus a fingerprint of its
+    values, so files sharing a header don't share types. Pass a fingerprint that
+    cleaning doesn't change (e.g. the raw file's shape and head) to make
+    re-running on a cleaned copy a dictionary lookup; by default the key is the
+    DataFrame's dtypes and its own first rows.
+    """
+    key = _schema_hash(df, fingerprint)
+    with _column_type_cache_lock:
+        if key in _column_type_cache:
+            _column_type_cache.move_to_end(key)
+            return _column_type_cache[key]
+
+    names = pd.Series([str(c).lower() for c in df.columns], index=df.columns)
+    name_is_time = names.str.contains(_TIME_NAMES)
+    name_is_category = names.str.contains(_CATEGORY_NAMES)
+    name_is_measure = names.str.contains(_MEASURE_NAMES)
+    name_is_id = names.str.contains(_ID_NAMES)
+
+    # One row sample for the whole sheet, kept in original order for the monotonic check
+    sample = df.sample(n=min(len(df), TYPE_SAMPLE_ROWS), random_state=0).sort_index() if len(df) else df
+    types = {role: [] for role in ('time', 'measure', 'currency', 'category', 'id', 'text')}
+
+    # --- Datetime and numeric columns: decided from dtype and value statistics ---
+    types['time'] += df.select_dtypes(include=['datetime', 'datetimetz']).columns.tolist()
+    num_cols = df.select_dtypes(include='number').columns.tolist()
+    if num_cols:
+        numeric = sample[num_cols]
+        counts = numeric.count()
+        unique_ratio = numeric.nunique() / counts.clip(lower=1)
+        is_integer = ((numeric % 1 == 0) | numeric.isna()).all()
+        is_year = is_integer & numeric.min().between(1900, 2100) & numeric.max().between(1900, 2100)
+        is_increasing = numeric.apply(lambda col: col.dropna().is_monotonic_increasing)
+        looks_like_id = is_integer & (counts > 1) & (
+            (name_is_id[num_cols] & (unique_ratio >= 0.95)) | ((unique_ratio == 1) & is_increasing)
+        )
+        for col in num_cols:
+            if name_is_time[col] and is_year[col]:
+                types['time'].append(col)
+            elif looks_like_id[col] and not name_is_measure[col]:
+                types['id'].append(col)
+            else:
+                types['measure'].append(col)
+
+    # --- Text columns: match all sampled values at once, then share per column ---
+    text_cols = [c for c in df.columns if c not in num_cols and c not in types['time']]
+    if text_cols:
+        # Shares are over non-missing values (stack() keeps NaN in newer pandas)
+        values = sample[text_cols].stack().dropna().astype(str).str.strip()
+        column = values.index.get_level_values(1)
+        date_share = values.str.fullmatch(_DATE_VALUES).groupby(column).mean()
+        currency_share = values.str.fullmatch(_CURRENCY_VALUES).groupby(column).mean()
+        id_share = values.str.fullmatch(_ID_VALUES).groupby(column).mean()
+        counts = values.groupby(column).size()
+        unique = values.groupby(column).nunique()
+        for col in text_cols:
+            if col not in counts.index:
+                types['text'].append(col)  # Entirely empty in the sample
+            elif date_share[col] >= VALUE_MATCH_SHARE:
+                types['time'].append(col)
+            elif currency_share[col] >= VALUE_MATCH_SHARE:
+                types['currency'].append(col)
+            elif unique[col] / counts[col] >= 0.95 and counts[col] > 1 and (name_is_id[col] or id_share[col] >= VALUE_MATCH_SHARE):
+                types['id'].append(col)
+            elif name_is_category[col] or unique[col] <= CATEGORY_MAX_UNIQUE or unique[col] <= counts[col] / 2:
+                types['category'].append(col)
+            else:
+                types['text'].append(col)
+
+    types['time'] = _name_first([c for c in df.columns if c in types['time']], name_is_time)
+    types['measure'] = _name_first(types['measure'], name_is_measure)
+    types['category'] = _name_first(types['category'], name_is_category)
+
+    with _column_type_cache_lock:
+        _column_type_cache[key] = types
+        if len(_column_type_cache) > _COLUMN_TYPE_CACHE_SIZE:
+            _column_type_cache.popitem(last=False)
+    return types
+
+
 # --- UPGRADED "AI" REPORTING FUNCTION ---
-def generate_report(summary, data):
+def generate_report(summary, data, cleaning_applied=False):
     report = "## 📊 Automated Data Analysis Report\n\n"
     
     if not summary:
@@ -44,11 +434,6 @@ def generate_report(summary, data):
 
     report += f"The uploaded workbook contains **{len(summary)} sheet(s)**.\n\n"
     
-    time_keywords = ['date', 'day', 'month', 'year', 'timestamp', 'time']
-    cat_keywords = ['region', 'country', 'city', 'state', 'department', 'category', 'gender', 'status', 'type', 'group']
-    measure_keywords = ['sales', 'amount', 'revenue', 'count', 'cases', 'salary', 'price', 'quantity', 'value', 'score', 'rate', 'cost', 'profit']
-    id_keywords = ['id', 'uuid', 'key', 'code', 'number']
-
     for sheet_name, sheet_summary in summary.items():
         df = data[sheet_name]
         rows, cols = sheet_summary['Shape']
@@ -65,10 +450,12 @@ def generate_report(summary, data):
         # --- 2. Thematic Summary (Heuristic) ---
         report += f"#### 2. Thematic Summary & Advice\n\n"
         
-        time_cols = [c for c in df.columns if any(kw in c.lower() for kw in time_keywords)]
-        measure_cols = [c for c in num_cols_list if any(kw in c.lower() for kw in measure_keywords)]
-        cat_cols = [c for c in cat_cols_list if any(kw in c.lower() for kw in cat_keywords)]
-        id_cols = [c for c in cat_cols_list if any(kw in c.lower() for kw in id_keywords)]
+        # The raw file's shape and head don't change with cleaning, so regenerating is a cache hit
+        column_types = infer_column_types(df, fingerprint=(sheet_summary['Shape'], sheet_summary['Head']))
+        time_cols = column_types['time']
+        measure_cols = column_types['measure']
+        cat_cols = column_types['category']
+        currency_cols = column_types['currency']
 
         report += "**What is this file? (Inferred Summary):**\n"
         if time_cols and measure_cols and cat_cols:
@@ -93,10 +480,21 @@ def generate_report(summary, data):
         # --- 3. Data Criticism & Quality Issues ---
         report += f"\n#### 3. Data Criticism & Quality Issues\n\n"
         
-        missing_total = df.isnull().sum().sum()
+        # Streamed files only keep a sample in memory, so prefer the full-file profile.
+        # That profile describes the raw file, so once cleaning is on use the cleaned sample.
+        is_streamed = 'Null_Counts' in sheet_summary
+        use_profile = is_streamed and not cleaning_applied
+        if use_profile:
+            missing_total = sum(sheet_summary['Null_Counts'].values())
+            report += f"* ℹ️ **Large File:** Charts, previews and duplicate checks use a random sample of **{len(df)} rows**. Missing values and correlations cover all **{rows} rows**.\n"
+        elif is_streamed:
+            missing_total = df.isnull().sum().sum()
+            report += f"* ℹ️ **Large File (Cleaned):** All figures below come from the cleaned random sample of **{len(df)} rows**, not the full **{rows} rows**.\n"
+        else:
+            missing_total = df.isnull().sum().sum()
         duplicate_count = df.duplicated().sum()
         
-        if missing_total == 0 and duplicate_count == 0:
+        if missing_total == 0 and duplicate_count == 0 and not currency_cols:
             report += "* ✅ **Excellent!** No missing values or duplicate rows were found. This data is clean.\n"
         
         if missing_total > 0:
@@ -106,6 +504,10 @@ def generate_report(summary, data):
         if duplicate_count > 0:
             report += f"* ⚠️ **Duplicate Rows:** **{duplicate_count} identical rows** were found.\n"
             report += f"    * **Criticism:** This will lead to double-counting and inflated totals. Use the 'Data Cleaning' tab to remove these.\n"
+
+        if currency_cols:
+            report += f"* ⚠️ **Amounts Stored as Text:** `{'`, `'.join(currency_cols)}` contain currency values written as text (e.g. `$1,200`).\n"
+            report += f"    * **Criticism:** Text can't be summed, averaged or charted as a number. Remove the currency symbols and separators in the source file so these become numeric columns.\n"
             
         # --- 4. NEW: Key Insights & Discoveries ---
         report += f"\n#### 4. Key Insights & Discoveries (AI-Generated)\n\n"
@@ -115,7 +517,10 @@ def generate_report(summary, data):
         else:
             # Insight 1: Correlations
             try:
-                corr_matrix = df[num_cols_list].corr()
+                if use_profile:
+                    corr_matrix = pd.DataFrame(sheet_summary['Correlation']).loc[num_cols_list, num_cols_list].astype(float)
+                else:
+                    corr_matrix = df[num_cols_list].corr()
                 # Find the strongest positive/negative correlations
                 corr_pairs = corr_matrix.unstack().sort_values(ascending=False)
                 # Remove self-correlations
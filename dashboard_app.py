@@ -8,7 +8,8 @@ import base64
 import io
 
 # Import the functions from your other file
-from analysis_module import analyze_excel, generate_report
+from analysis_module import analyze_file, estimate_peak_memory, generate_report
+from admission_control import upload_budget, UploadRejected, UPLOAD_MEMORY_BUDGET_MB
 import excel_exporter
 
 # --- NEW: Import forecasting library ---
@@ -86,8 +87,9 @@ homepage_layout = dbc.Container([
                         id='upload-data', # This is the trigger
                         children=html.Div([
                             'Drag and Drop or ',
-                            html.A('Select Your Excel File')
+                            html.A('Select Your Excel, CSV or Parquet File')
                         ]),
+                        accept='.xlsx,.xls,.csv,.parquet',
                         style={
                             'width': '100%', 'height': '120px', 'lineHeight': '120px',
                             'borderWidth': '2px', 'borderStyle': 'dashed',
@@ -97,7 +99,8 @@ homepage_layout = dbc.Container([
                     ),
                     dbc.Alert([
                         html.I(className="bi bi-info-circle-fill me-2"),
-                        "Upload an Excel file (.xlsx, .xls) to instantly generate a detailed report and interactive dashboard."
+                        "Upload an Excel (.xlsx, .xls), CSV (.csv) or Parquet (.parquet) file to instantly generate a detailed report and interactive dashboard. Large CSV and Parquet files are streamed and charted from a random sample."
+                        f" Uploads are held in server memory while they are analyzed, so files larger than about {UPLOAD_MEMORY_BUDGET_MB // 3:,} MB (less for very wide tables) are not accepted."
                     ], color="primary", className="mt-3")
                 ])
             ]),
@@ -260,6 +263,8 @@ app.layout = html.Div([
     dcc.Store(id='stored-data-summary'),
     dcc.Store(id='stored-data-sheet-options'), # This holds the RAW data
     dcc.Store(id='cleaned-data-store'),       # This holds the CLEANED data
+    dcc.Store(id='upload-ticket'),            # Place in the upload queue when the server is busy
+    dcc.Interval(id='upload-retry-interval', interval=2000, disabled=True),
     
     navbar, # The Navbar is always visible
     homepage_layout,
@@ -283,29 +288,71 @@ def parse_contents(contents):
      Output('stored-data-summary', 'data'),
      Output('stored-data-sheet-options', 'data'),
      Output('upload-error-alert', 'children'),    # --- ADDED ---
-     Output('upload-error-alert', 'is_open')],   # --- ADDED ---
-    [Input('upload-data', 'contents')]
+     Output('upload-error-alert', 'is_open'),    # --- ADDED ---
+     Output('upload-error-alert', 'color'),
+     Output('upload-ticket', 'data'),
+     Output('upload-retry-interval', 'disabled'),
+     Output('upload-data', 'contents')],  # Cleared so queue retries don't re-send the file
+    [Input('upload-data', 'contents'),
+     Input('upload-retry-interval', 'n_intervals')],  # Retries a queued upload
+    [State('upload-data', 'filename'),
+     State('upload-ticket', 'data')]
 )
-def handle_file_upload(contents):
-    if contents is None:
+def handle_file_upload(contents, n_intervals, filename, ticket):
+    is_retry = dash.ctx.triggered_id == 'upload-retry-interval'
+    if is_retry and not ticket:
+        raise dash.exceptions.PreventUpdate
+    if not is_retry and contents is None:
         # No upload yet, show homepage and hide dashboard
-        return {'display': 'block'}, {'display': 'none'}, False, dash.no_update, dash.no_update, None, False
+        return {'display': 'block'}, {'display': 'none'}, False, dash.no_update, dash.no_update, None, False, 'danger', None, True, dash.no_update
 
-    file_buffer = parse_contents(contents)
-    
-    # --- FIX: Check for the new error_message ---
-    summary, data, error_message = analyze_excel(file_buffer)
-    
-    if summary is None or error_message:
-        # Upload failed, stay on homepage and show the error
-        error_text = f"File Upload Failed: {error_message}"
-        return {'display': 'block'}, {'display': 'none'}, False, None, None, error_text, True
+    # --- NEW: Admission control, estimated from size and dimensions before parsing ---
+    # Everything after admission is inside try/finally so the reservation is always released
+    try:
+        if is_retry:
+            # A queued upload: only the ticket is sent, the file was spooled to disk
+            try:
+                file_buffer, queue_position = upload_budget.retry(ticket)
+            except UploadRejected as e:
+                error_text = f"File Upload Failed: {e}"
+                return {'display': 'block'}, {'display': 'none'}, False, None, None, error_text, True, 'danger', None, True, dash.no_update
+        else:
+            if ticket:
+                upload_budget.cancel(ticket)  # A new file replaces one still in the queue
+                ticket = None
+
+            file_buffer = parse_contents(contents)
+            # The base64 string and the decoded bytes are both held on the first attempt
+            estimated_bytes = len(contents) + estimate_peak_memory(file_buffer, filename)
+            try:
+                ticket, queue_position = upload_budget.submit(file_buffer, estimated_bytes)
+            except UploadRejected as e:
+                error_text = f"File Upload Failed: {e}"
+                return {'display': 'block'}, {'display': 'none'}, False, None, None, error_text, True, 'danger', None, True, None
+
+        if queue_position is not None:
+            # Server is busy: stay on homepage, show our place and retry on the interval
+            queue_text = f"The server is busy processing other uploads. Your file is number {queue_position} in the queue and will be analyzed automatically."
+            return {'display': 'block'}, {'display': 'none'}, False, dash.no_update, dash.no_update, queue_text, True, 'warning', ticket, False, None
+
+        # --- FIX: Check for the new error_message ---
+        summary, data, error_message = analyze_file(file_buffer, filename)
+
+        if summary is None or error_message:
+            # Upload failed, stay on homepage and show the error
+            error_text = f"File Upload Failed: {error_message}"
+            return {'display': 'block'}, {'display': 'none'}, False, None, None, error_text, True, 'danger', None, True, None
+
+        # Upload succeeded!
+        json_data = {sheet: df.to_json(orient='split') for sheet, df in data.items()}
+    finally:
+        # Only drops an admitted reservation; a queued ticket keeps its place.
+        # Note: Dash serializes the response after this returns, outside the budget
+        if ticket:
+            upload_budget.release(ticket)
 
-    # Upload succeeded!
-    json_data = {sheet: df.to_json(orient='split') for sheet, df in data.items()}
-    
     # Hide homepage, show dashboard, and store the data
-    return {'display': 'none'}, {'display': 'block'}, True, summary, json_data, None, False
+    return {'display': 'none'}, {'display': 'block'}, True, summary, json_data, None, False, 'danger', None, True, None
 
 # --- NEW: Callback to clean the data ---
 @callback(
@@ -346,9 +393,11 @@ def clean_data(json_data, remove_duplicates, drop_na):
      Output('chart6-x', 'options'), Output('chart6-y', 'options'), Output('chart6-color', 'options')],
      # Forecasting outputs were removed, so this is the complete list
     [Input('cleaned-data-store', 'data')], # <-- ONLY triggered by clean data
-    [State('stored-data-summary', 'data')]  # <-- Get summary as State
+    [State('stored-data-summary', 'data'),  # <-- Get summary as State
+     State('clean-duplicates-switch', 'value'),
+     State('clean-na-switch', 'value')]
 )
-def update_all_tabs_from_cleaned_data(cleaned_json_data, summary):
+def update_all_tabs_from_cleaned_data(cleaned_json_data, summary, remove_duplicates, drop_na):
     if not cleaned_json_data or not summary:
         # 4 outputs + 18 chart outputs = 22 total
         return ([], None, "Please upload a file to begin.", None) + ([[]]*18)
@@ -361,7 +410,7 @@ def update_all_tabs_from_cleaned_data(cleaned_json_data, summary):
     selected_sheet = sheet_options[0]['value']
     
     # --- 2. Generate AI Report ---
-    report = generate_report(summary, data_dfs)
+    report = generate_report(summary, data_dfs, cleaning_applied=bool(remove_duplicates or drop_na))
     
     # --- 3. Generate Data Preview Table ---
     df_preview = data_dfs[selected_sheet]
@@ -392,21 +441,33 @@ def update_all_tabs_from_cleaned_data(cleaned_json_data, summary):
     [Input('dashboard-tabs', 'active_tab'),
      Input('sheet-selector-dropdown', 'value'),
      Input('theme-selector', 'value')],
-    [State('cleaned-data-store', 'data')]
+    [State('cleaned-data-store', 'data'),
+     State('stored-data-summary', 'data'),
+     State('clean-duplicates-switch', 'value'),
+     State('clean-na-switch', 'value')]
 )
-def update_correlation_heatmap(active_tab, selected_sheet, template, cleaned_json_data):
+def update_correlation_heatmap(active_tab, selected_sheet, template, cleaned_json_data, summary, remove_duplicates, drop_na):
     if active_tab != 'tab-2' or not selected_sheet or not cleaned_json_data:
         return go.Figure()
-        
-    df = pd.read_json(io.StringIO(cleaned_json_data[selected_sheet]), orient='split')
-    num_cols = df.select_dtypes(include='number').columns.tolist()
-    
+
+    sheet_summary = (summary or {}).get(selected_sheet, {})
+    title = f"Correlation Heatmap for {selected_sheet}"
+    if 'Correlation' in sheet_summary and not (remove_duplicates or drop_na):
+        # Streamed file: use the full-file correlation, not the sample
+        num_cols = sheet_summary['Numeric_Columns']
+        corr = pd.DataFrame(sheet_summary['Correlation']).loc[num_cols, num_cols].astype(float)
+    else:
+        df = pd.read_json(io.StringIO(cleaned_json_data[selected_sheet]), orient='split')
+        num_cols = df.select_dtypes(include='number').columns.tolist()
+        corr = df[num_cols].corr()
+        if 'Correlation' in sheet_summary:
+            title += " (cleaned sample)"
+
     if len(num_cols) < 2:
         return go.Figure().update_layout(title="Not enough numeric data for correlation", template=template)
-    
-    corr = df[num_cols].corr()
+
     fig = px.imshow(corr, text_auto=True, aspect="auto",
-                    title=f"Correlation Heatmap for {selected_sheet}",
+                    title=title,
                     template=template, color_continuous_scale='RdBu_r')
     return fig
 
@@ -530,10 +591,12 @@ clientside_callback(
      Output('excel-toast', 'is_open')],
     [Input('btn-export-excel', 'n_clicks')],
     [State('stored-data-summary', 'data'),
-     State('cleaned-data-store', 'data')], # Use CLEANED data for export
+     State('cleaned-data-store', 'data'), # Use CLEANED data for export
+     State('clean-duplicates-switch', 'value'),
+     State('clean-na-switch', 'value')],
     prevent_initial_call=True
 )
-def download_excel_report(n_clicks, summary, cleaned_json_data):
+def download_excel_report(n_clicks, summary, cleaned_json_data, remove_duplicates, drop_na):
     if not n_clicks or not cleaned_json_data or not summary:
         return dash.no_update, False # Do not open toast
 
@@ -542,7 +605,7 @@ def download_excel_report(n_clicks, summary, cleaned_json_data):
         data_dfs = {sheet: pd.read_json(io.StringIO(cleaned_json_data[sheet]), orient='split') for sheet in cleaned_json_data}
         
         # Generate the report based on the *cleaned* data
-        report_string = generate_report(summary, data_dfs)
+        report_string = generate_report(summary, data_dfs, cleaning_applied=bool(remove_duplicates or drop_na))
         
         # Call the exporter function
         excel_buffer = excel_exporter.create_excel_report_in_memory(summary, data_dfs, report_string)
@@ -557,4 +620,4 @@ def download_excel_report(n_clicks, summary, cleaned_json_data):
 
 # --- Run the App ---
 if __name__ == '__main__':
-    app.run(debug=False, port=8050)
\ No newline at end of file
+    app.run(debug=False, port=8050)
\ No newline at end of file